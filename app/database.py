@@ -1,15 +1,10 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, text
 from sqlalchemy.orm import sessionmaker, declarative_base
-from pydantic_settings import BaseSettings
-from dotenv import load_dotenv
-import os
+from sqlalchemy.pool import StaticPool
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 
-load_dotenv()
-
-class Settings(BaseSettings):
-    database_url: str = os.getenv("DATABASE_URL", "sqlite:///./local.db")
-
-settings = Settings()
+from .settings import settings
 
 # Get the URL from settings
 db_url = settings.database_url
@@ -20,11 +15,61 @@ if db_url and db_url.startswith("postgres://"):
 # ---------------------
 
 # Use the corrected URL to create the engine
-engine = create_engine(db_url, future=True, pool_pre_ping=True) # Use db_url here
+if db_url.startswith("sqlite"):
+    # SQLite ignores QueuePool sizing; share connections across the threadpool instead
+    sqlite_kwargs = {"connect_args": {"check_same_thread": False}}
+    if ":memory:" in db_url or db_url in ("sqlite://", "sqlite:///"):
+        sqlite_kwargs["poolclass"] = StaticPool # In-memory DB must reuse one connection
+    engine = create_engine(db_url, future=True, **sqlite_kwargs)
+
+    if "poolclass" not in sqlite_kwargs:
+        @event.listens_for(engine, "connect")
+        def _enable_wal(dbapi_connection, connection_record):
+            # WAL lets readers (admin/metrics) run while a check-in is being written
+            cursor = dbapi_connection.cursor()
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.close()
+else:
+    engine = create_engine(
+        db_url,
+        future=True,
+        pool_pre_ping=True,
+        pool_size=settings.pool_size,
+        max_overflow=settings.max_overflow,
+        pool_timeout=settings.pool_timeout,
+        pool_recycle=settings.pool_recycle,
+        pool_use_lifo=True, # Reuse the most recent connection so idle overflow ones can expire
+    )
 
-SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True)
+# Keep loaded attributes after commit so handlers can read rec.id etc. without a reload SELECT
+SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False, expire_on_commit=False, future=True)
 Base = declarative_base()
 
+def upsert_insert(model):
+    """Returns a dialect-specific INSERT that supports ON CONFLICT clauses."""
+    if engine.dialect.name == "postgresql":
+        return pg_insert(model)
+    return sqlite_insert(model)
+
+def skip_commit_flush(db):
+    """Lets this transaction's COMMIT return before its WAL record reaches disk (Postgres only)."""
+    # A server crash can lose the last few hundred ms of such commits, but never corrupts data or constraints
+    if engine.dialect.name == "postgresql":
+        db.execute(text("SET LOCAL synchronous_commit TO OFF"))
+
+def pool_stats():
+    """Returns connection pool occupancy for the health check (QueuePool only reports sizes)."""
+    pool = engine.pool
+    if not hasattr(pool, "checkedout"):
+        return {"pool": type(pool).__name__}
+    return {
+        "pool": type(pool).__name__,
+        "size": pool.size(),
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+    }
+
 def get_db():
     db = SessionLocal()
     try:
@@ -1,26 +1,47 @@
 # app/main.py
 
-from fastapi import FastAPI, Request, Depends, Response, Form
+from fastapi import FastAPI, Request, Depends, Response, Form, HTTPException
 from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse, RedirectResponse, PlainTextResponse # Add PlainTextResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, PlainTextResponse, StreamingResponse, ORJSONResponse # Add PlainTextResponse
+from sqlalchemy import select, update, delete, func, or_, and_
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 from sqlalchemy.orm import Session
 from datetime import date, datetime, timezone # Import date
-from zoneinfo import ZoneInfo
-from collections import defaultdict # Import defaultdict
+from collections import defaultdict, namedtuple # Import defaultdict
+from functools import lru_cache
+from types import SimpleNamespace
 from starlette.middleware.sessions import SessionMiddleware # Add SessionMiddleware
+from anyio import to_thread
 
-from .security import get_password_hash, verify_password
+from .security import get_password_hash, verify_password, password_needs_rehash, require_admin
 
-from .settings import settings
+from .settings import settings, EST_ZONE
+from .templating import templates
 from .routers import attendance as attendance_router
 from .routers import metrics as metrics_router
-from .database import get_db
-from .models import Attendance, Employee
+from .database import get_db, upsert_insert, pool_stats
+from .models import Attendance, Employee, bulk_insert_attendance
 
+import hmac
+import logging
 import os
+import re
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Optional
 
-app = FastAPI(title="Greenville Check-in")
+logging.basicConfig(level=settings.log_level.upper())
+logger = logging.getLogger(__name__)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Sync routes run in AnyIO's threadpool. Cap it at the DB pool's capacity so extra
+    # requests wait for a thread instead of holding one until pool_timeout expires.
+    to_thread.current_default_thread_limiter().total_tokens = settings.pool_size + settings.max_overflow
+    yield
+
+# JSON routes (finalize, metrics, month pages) serialize with orjson instead of json.dumps
+app = FastAPI(title="Greenville Check-in", lifespan=lifespan, default_response_class=ORJSONResponse)
 
 # --- ADD SESSION MIDDLEWARE (Must be before routers) ---
 SESSION_TIMEOUT_SECONDS = 8 * 60 * 60 # 8 hours in seconds
@@ -32,11 +53,12 @@ app.add_middleware(
 )
 # --------------------------------------------------------
 
+# Build paths relative to the current file (main.py), resolved once
+BASE_DIR = Path(__file__).resolve().parent
+STATIC_DIR = BASE_DIR / "static"
+
 # Remove or comment out the StaticFiles line if you don't have an app/static folder
-app.mount("/static", StaticFiles(directory="app/static"), name="static") 
-# Build path relative to the current file (main.py)
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-templates = Jinja2Templates(directory=os.path.join(BASE_DIR, "templates"))
+app.mount("/static", StaticFiles(directory=os.fspath(STATIC_DIR)), name="static") 
 
 # --- ADD OAUTH SETUP ---
 #oauth = OAuth()
@@ -49,16 +71,51 @@ templates = Jinja2Templates(directory=os.path.join(BASE_DIR, "templates"))
 #)
 # ------------------------
 
+@lru_cache(maxsize=128)
+def _render_static_page(template_name, user_name, is_admin):
+    """Renders a page whose only per-request inputs are the navbar's user/admin state."""
+    # base.html only reads the session user and admin flag, so a stand-in request is enough
+    session = {"user": {"name": user_name}} if user_name is not None else {}
+    if is_admin:
+        session["is_admin"] = True
+    page_request = SimpleNamespace(session=session)
+    return templates.get_template(template_name).render(request=page_request, sites=settings.sites)
+
+def static_page_response(template_name, request):
+    """Serves a mostly-static page from the render cache, keyed on who is logged in."""
+    user = request.session.get("user")
+    user_name = user.get("name") if user else None
+    is_admin = bool(request.session.get("is_admin"))
+    return HTMLResponse(_render_static_page(template_name, user_name, is_admin))
+
+STREAM_CHUNK_SIZE = 64 * 1024 # Bytes of rendered HTML flushed per chunk
+
+def _buffered_chunks(fragments):
+    """Joins Jinja's small generate() fragments into ~64 KB chunks so each threadpool hop sends real data."""
+    buffer, size = [], 0
+    for fragment in fragments:
+        buffer.append(fragment)
+        size += len(fragment)
+        if size >= STREAM_CHUNK_SIZE:
+            yield "".join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield "".join(buffer)
+
+@app.get("/health")
+async def health():
+    """Liveness check with DB pool occupancy; async and connection-free so it answers even when the pool is saturated."""
+    return {"status": "ok", "db_pool": pool_stats()}
+
 @app.get("/", response_class=HTMLResponse)
-def home(request: Request):
-    user = request.session.get("user") # Pass user info to template
-    return templates.TemplateResponse("home.html", {"request": request, "sites": settings.sites, "user": user})
+async def home(request: Request):
+    return static_page_response("home.html", request)
 
 app.include_router(attendance_router.router, prefix="", tags=["attendance"])
 app.include_router(metrics_router.router, prefix="", tags=["metrics"]) # ADD THIS LINE
 
 @app.get("/register", response_class=HTMLResponse)
-def register_page(request: Request):
+async def register_page(request: Request):
     return templates.TemplateResponse("register.html", {"request": request})
 
 @app.post("/register")
@@ -70,27 +127,26 @@ def register_user(
     password: str = Form(...),
     db: Session = Depends(get_db)
 ):
-    # 1. Check if user exists
-    existing_user = db.query(Employee).filter(Employee.email == email).first()
-    if existing_user:
-        return templates.TemplateResponse("register.html", {
-            "request": request, 
-            "error": "Email already registered. Please login."
-        })
-
-    # 2. Create new user
+    # 1. Create new user in one round trip; the unique email index rejects duplicates
     full_name = f"{first_name} {last_name}"
     hashed_pwd = get_password_hash(password)
-    
-    new_employee = Employee(
+
+    stmt = upsert_insert(Employee).values(
         email=email,
         display_name=full_name,
         password_hash=hashed_pwd,
         status="active"
-    )
-    db.add(new_employee)
+    ).on_conflict_do_nothing(index_elements=["email"]).returning(Employee.id)
+    new_id = db.execute(stmt).scalar()
     db.commit()
 
+    # 2. Nothing inserted means the user already exists
+    if new_id is None:
+        return templates.TemplateResponse("register.html", {
+            "request": request, 
+            "error": "Email already registered. Please login."
+        })
+
     # 3. Auto-login (set session)
     request.session["user"] = {"email": email, "name": full_name}
     
@@ -100,7 +156,7 @@ def register_user(
 # --- NEW LOGIN ROUTES ---
 
 @app.get("/login", response_class=HTMLResponse)
-def login_page(request: Request):
+async def login_page(request: Request):
     return templates.TemplateResponse("login.html", {"request": request})
 
 @app.post("/login")
@@ -120,6 +176,11 @@ def login_submit(
             "error": "Invalid email or password"
         })
 
+    # Upgrade legacy bcrypt hashes to Argon2 now that we have the plaintext
+    if password_needs_rehash(user.password_hash):
+        user.password_hash = get_password_hash(password)
+        db.commit()
+
     # 3. Set Session
     request.session["user"] = {"email": user.email, "name": user.display_name}
 
@@ -129,8 +190,8 @@ def login_submit(
     return RedirectResponse(url=f"/scan?site={intended_site}", status_code=303)
 
 @app.get("/checkin-success", response_class=HTMLResponse)
-def checkin_success(request: Request):
-    return templates.TemplateResponse("checkin_success.html", {"request": request})
+async def checkin_success(request: Request):
+    return static_page_response("checkin_success.html", request)
 
 @app.get("/logout")
 @app.get("/logout")
@@ -139,9 +200,9 @@ def logout(request: Request):
     return RedirectResponse(url="/", status_code=303)
 
 @app.get("/already-checked-in", response_class=HTMLResponse)
-def already_checked_in(request: Request):
+async def already_checked_in(request: Request):
     """Displays a message that the user already checked in today."""
-    return templates.TemplateResponse("already_checked_in.html", {"request": request})
+    return static_page_response("already_checked_in.html", request)
 
 # --- Admin Authentication (Keep your existing admin routes) ---
 @app.get("/admin/login", response_class=HTMLResponse)
@@ -149,128 +210,234 @@ def admin_login_page(request: Request):
     return templates.TemplateResponse("admin_login.html", {"request": request})
 
 @app.post("/admin/login")
-def process_admin_login(response: Response, password: str = Form(...)):
-    if password == settings.admin_password:
-        response = RedirectResponse(url="/admin", status_code=303)
-        response.set_cookie(key="admin_auth", value="super_secret_token", httponly=True, samesite="lax")
-        return response
+def process_admin_login(request: Request, password: str = Form(...)):
+    # Constant-time compare so response timing doesn't leak how much of the password matched
+    if hmac.compare_digest(password.encode(), settings.admin_password.encode()):
+        request.session["is_admin"] = True # Signed by SessionMiddleware along with the rest of the session
+        return RedirectResponse(url="/admin", status_code=303)
     else:
         return RedirectResponse(url="/admin/login", status_code=303)
 
 @app.get("/admin/logout")
-def admin_logout(response: Response):
-    response = RedirectResponse(url="/", status_code=303)
-    response.delete_cookie(key="admin_auth")
-    return response
+def admin_logout(request: Request):
+    request.session.pop("is_admin", None)
+    return RedirectResponse(url="/", status_code=303)
 
 # Inside app/main.py
 
-@app.get("/admin", response_class=HTMLResponse)
-def admin_dashboard(request: Request, db: Session = Depends(get_db)):
-    """Shows the main admin dashboard with attendance records grouped by month and reason."""
-    
-    if request.cookies.get("admin_auth") != "super_secret_token":
-        return RedirectResponse(url="/admin/login")
-    
-    # Fetch all valid check-in records, most recent first
-    all_records_raw = db.query(Attendance)\
-                        .filter(Attendance.event_type == "check_in", Attendance.is_valid == True)\
-                        .order_by(Attendance.timestamp_utc.desc())\
-                        .all()
-    
-    # --- Format Timestamps and Prepare Data ---
+DETAIL_ROWS_PER_GROUP = 50 # Latest records listed under each accordion group
+MONTH_PAGE_SIZE = 200 # Records returned per "load more" request for a month
+TABLE_PAGE_SIZE = 100 # Rows per page of the raw records table
+
+EstTimestamp = namedtuple("EstTimestamp", ["display", "iso_local"])
+NO_TIMESTAMP = EstTimestamp("N/A", "") # Empty string for input if None
+
+def _format_est_timestamp(timestamp_utc):
+    """Returns the EST display string and datetime-local input value for a UTC timestamp."""
+    if not timestamp_utc:
+        return NO_TIMESTAMP
+    timestamp_est = timestamp_utc.astimezone(EST_ZONE)
+    # One isoformat() call, sliced into each display form ("YYYY-MM-DD HH:MM:SS-05:00")
+    iso_str = timestamp_est.isoformat(sep=' ', timespec='seconds')
+    return EstTimestamp(
+        f"{iso_str[:19]} {timestamp_est.tzname()}", # e.g. "2025-10-01 09:30:00 EDT"
+        f"{iso_str[:10]}T{iso_str[11:16]}", # HTML datetime-local input (YYYY-MM-DDTHH:MM)
+    )
+
+def _page_cursor(rec):
+    """Encodes the (timestamp_utc, id) keyset position of a record."""
+    return f"{rec.timestamp_utc.isoformat()}|{rec.id}"
+
+def _older_than_cursor(cursor):
+    """Filter for check-ins strictly older than a _page_cursor() position, newest-first order."""
     try:
-        est_zone = ZoneInfo("America/New_York")
-    except Exception:
-        est_zone = timezone.utc 
-        print("WARNING: Could not load America/New_York timezone. Falling back to UTC.")
-
-    formatted_records = []
-    records_by_month = defaultdict(list)
-    records_by_reason = defaultdict(list)
-    records_by_business_line = defaultdict(list)
+        cursor_ts_str, _, cursor_id_str = cursor.rpartition("|")
+        cursor_ts = datetime.fromisoformat(cursor_ts_str)
+        cursor_id = int(cursor_id_str)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+    return or_(
+        Attendance.timestamp_utc < cursor_ts,
+        and_(Attendance.timestamp_utc == cursor_ts, Attendance.id < cursor_id),
+    )
+
+@app.get("/admin", response_class=HTMLResponse, dependencies=[Depends(require_admin)])
+def admin_dashboard(request: Request, before: Optional[str] = None, error: Optional[str] = None, db: Session = Depends(get_db)):
+    """Shows the main admin dashboard with attendance records grouped by month and reason."""
     
-    for rec in all_records_raw:
-        # Format timestamp
-        if rec.timestamp_utc:
-            timestamp_est = rec.timestamp_utc.astimezone(est_zone)
-            est_str = timestamp_est.strftime('%Y-%m-%d %H:%M:%S %Z') 
-            # Format specifically for HTML datetime-local input (YYYY-MM-DDTHH:MM)
-            iso_local_str = timestamp_est.strftime('%Y-%m-%dT%H:%M')
-            month_key = timestamp_est.strftime('%Y-%m') # Key for month grouping (e.g., "2025-10")
-            record_date = timestamp_est.date() # Get date object for sorting later if needed
-        else:
-            est_str = 'N/A'
-            iso_local_str = '' # Empty string for input if None
-            month_key = "Unknown Month"
-            record_date = None # Cannot determine date
-
-        # Create dictionary for easier template access
-        formatted_rec = {
-            "id": rec.id,
-            "timestamp_utc": rec.timestamp_utc, 
-            "timestamp_display": est_str,     
-            "timestamp_iso_local": iso_local_str, 
-            "site": rec.site,
-            "event_type": rec.event_type,
-            "user_name": rec.user_name,
-            "visit_reason": rec.visit_reason, 
-            "business_line": rec.business_line,
-            "device_local_id": rec.device_local_id,
-            "geo_lat": rec.geo_lat,
-            "geo_lon": rec.geo_lon,
-            "date_obj": record_date # Store date object if needed
-        }
-        formatted_records.append(formatted_rec)
-        
-        # --- Group by Month ---
-        records_by_month[month_key].append(formatted_rec)
-        
-        # --- Group by Reason ---
-        reason_key = rec.visit_reason if rec.visit_reason else "N/A" # Group None/empty as "N/A"
-        records_by_reason[reason_key].append(formatted_rec)
-
-        # --- Group by Business Line ---
-        business_line_key = rec.business_line if rec.business_line else "N/A"
-        records_by_business_line[business_line_key].append(formatted_rec)
-        # ----------------------------
-        
+    checkin_filter = (Attendance.event_type == "check_in", Attendance.is_valid == True)
+
+    # --- Group keys (month comes from the local EST date, "YYYY-MM") ---
+    month_key = func.coalesce(func.substr(Attendance.local_date, 1, 7), "Unknown Month").label("month_key")
+    reason_key = func.coalesce(func.nullif(Attendance.visit_reason, ""), "N/A").label("reason_key") # Group None/empty as "N/A"
+    business_line_key = func.coalesce(func.nullif(Attendance.business_line, ""), "N/A").label("business_line_key")
+
+    # --- Check-in counts per group, aggregated in SQL ---
+    group_counts = db.execute(
+        select(month_key, reason_key, business_line_key, func.count().label("checkins"))
+        .where(*checkin_filter)
+        .group_by(month_key, reason_key, business_line_key)
+    ).all()
+
+    month_counts = defaultdict(int)
+    reason_counts = defaultdict(int)
+    business_line_counts = defaultdict(int)
+    for group in group_counts:
+        month_counts[group.month_key] += group.checkins
+        reason_counts[group.reason_key] += group.checkins
+        business_line_counts[group.business_line_key] += group.checkins
+
+    # --- Latest records per group, ranked in SQL ---
+    record_columns = (
+        Attendance.id,
+        Attendance.timestamp_utc,
+        Attendance.site,
+        Attendance.event_type,
+        Attendance.user_name,
+        Attendance.visit_reason,
+        Attendance.business_line,
+    ) # Only what admin.html renders; no Text columns (notes, user_agent)
+    newest_first = (Attendance.timestamp_utc.desc(), Attendance.id.desc()) # id breaks timestamp ties for the page cursor
+    ranked = select(
+        *record_columns,
+        month_key,
+        reason_key,
+        business_line_key,
+        func.row_number().over(partition_by=month_key, order_by=newest_first).label("month_rank"),
+        func.row_number().over(partition_by=reason_key, order_by=newest_first).label("reason_rank"),
+        func.row_number().over(partition_by=business_line_key, order_by=newest_first).label("business_line_rank"),
+    ).where(*checkin_filter).subquery()
+    group_details = db.execute(
+        select(ranked).where(or_(
+            ranked.c.month_rank <= DETAIL_ROWS_PER_GROUP,
+            ranked.c.reason_rank <= DETAIL_ROWS_PER_GROUP,
+            ranked.c.business_line_rank <= DETAIL_ROWS_PER_GROUP,
+        )).order_by(ranked.c.timestamp_utc.desc(), ranked.c.id.desc())
+    ).all()
+
+    # --- Group row indices (rows stay as SQL tuples; timestamps in a parallel list) ---
+    detail_timestamps = [_format_est_timestamp(rec.timestamp_utc) for rec in group_details]
+    month_indices = defaultdict(list)
+    reason_indices = defaultdict(list)
+    business_line_indices = defaultdict(list)
+
+    for i, rec in enumerate(group_details):
+        if rec.month_rank <= DETAIL_ROWS_PER_GROUP:
+            month_indices[rec.month_key].append(i)
+        if rec.reason_rank <= DETAIL_ROWS_PER_GROUP:
+            reason_indices[rec.reason_key].append(i)
+        if rec.business_line_rank <= DETAIL_ROWS_PER_GROUP:
+            business_line_indices[rec.business_line_key].append(i)
+
+    # Keyset cursor after the last listed record of each truncated month
+    month_cursors = {
+        month: _page_cursor(group_details[indices[-1]])
+        for month, indices in month_indices.items()
+        if month_counts[month] > len(indices)
+    }
+
+    # One page of valid check-in records for the table, most recent first.
+    # Keyset pagination (?before=<cursor>) walks the attendance_checkin_ts index.
+    stmt = select(*record_columns).where(*checkin_filter)
+    if before:
+        stmt = stmt.where(_older_than_cursor(before))
+    all_records = db.execute(stmt.order_by(*newest_first).limit(TABLE_PAGE_SIZE)).all()
+    all_timestamps = [_format_est_timestamp(rec.timestamp_utc) for rec in all_records]
+    table_next_cursor = _page_cursor(all_records[-1]) if len(all_records) == TABLE_PAGE_SIZE else None
+
     # Sort month keys (most recent first)
-    sorted_months = sorted([m for m in records_by_month.keys() if m != "Unknown Month"], reverse=True)
-    if "Unknown Month" in records_by_month:
+    sorted_months = sorted([m for m in month_counts.keys() if m != "Unknown Month"], reverse=True)
+    if "Unknown Month" in month_counts:
         sorted_months.append("Unknown Month")
         
     # Sort reason keys (alphabetical, N/A last?)
-    sorted_reasons = sorted([r for r in records_by_reason.keys() if r != "N/A"])
-    if "N/A" in records_by_reason:
+    sorted_reasons = sorted([r for r in reason_counts.keys() if r != "N/A"])
+    if "N/A" in reason_counts:
         sorted_reasons.append("N/A")
     # ------------------------------------
 
     # --- Sort Business Lines ---
-    sorted_business_lines = sorted([bl for bl in records_by_business_line.keys() if bl != "N/A"])
-    if "N/A" in records_by_business_line:
+    sorted_business_lines = sorted([bl for bl in business_line_counts.keys() if bl != "N/A"])
+    if "N/A" in business_line_counts:
         sorted_business_lines.append("N/A")
     # ---------------------------
 
-    return templates.TemplateResponse(
-        "admin.html", 
+    # Stream the page as it renders instead of building the whole HTML string first
+    page = templates.get_template("admin.html").generate(
         {
             "request": request, 
-            "records_by_month": records_by_month, 
+            "detail_records": group_details,
+            "detail_timestamps": detail_timestamps,
+            "month_indices": month_indices,
+            "month_counts": month_counts,
+            "month_cursors": month_cursors,
             "sorted_months": sorted_months,     
-            "records_by_reason": records_by_reason, 
+            "reason_indices": reason_indices,
+            "reason_counts": reason_counts,
             "sorted_reasons": sorted_reasons,
-            "records_by_business_line": records_by_business_line, # <-- PASS NEW DATA
+            "business_line_indices": business_line_indices,
+            "business_line_counts": business_line_counts,
             "sorted_business_lines": sorted_business_lines,      # <-- PASS NEW DATA     
-            "all_records": formatted_records,
+            "all_records": all_records,
+            "all_timestamps": all_timestamps,
+            "table_before": before,
+            "table_next_cursor": table_next_cursor,
+            "error": ADMIN_ERRORS.get(error), # Unknown codes show nothing
             "datetime": datetime # <-- ADD THIS TO PASS DATETIME OBJECT
         }
     )
+    return StreamingResponse(_buffered_chunks(page), media_type="text/html")
+
+@app.get("/admin/month/{year_month}", dependencies=[Depends(require_admin)])
+def admin_month_records(year_month: str, cursor: Optional[str] = None, db: Session = Depends(get_db)):
+    """Returns the next page of a month's check-ins, newest first, for the monthly accordion."""
+    if year_month == "Unknown Month":
+        month_filter = Attendance.local_date.is_(None)
+    elif re.match(r"^\d{4}-\d{2}$", year_month):
+        month_filter = Attendance.local_date.startswith(year_month + "-")
+    else:
+        raise HTTPException(status_code=400, detail="Invalid month format. Use YYYY-MM.")
+
+    stmt = select(
+        Attendance.id,
+        Attendance.timestamp_utc,
+        Attendance.site,
+        Attendance.user_name,
+        Attendance.visit_reason,
+    ).where(Attendance.event_type == "check_in", Attendance.is_valid == True, month_filter)
+
+    # --- Keyset pagination: everything strictly older than the cursor row ---
+    if cursor:
+        stmt = stmt.where(_older_than_cursor(cursor))
+
+    rows = db.execute(
+        stmt.order_by(Attendance.timestamp_utc.desc(), Attendance.id.desc()).limit(MONTH_PAGE_SIZE)
+    ).all()
+
+    return {
+        "records": [
+            {
+                "user_name": rec.user_name,
+                "site": rec.site,
+                "visit_reason": rec.visit_reason,
+                "timestamp_display": _format_est_timestamp(rec.timestamp_utc).display,
+            }
+            for rec in rows
+        ],
+        "next_cursor": _page_cursor(rows[-1]) if len(rows) == MONTH_PAGE_SIZE else None,
+    }
 # -------------------------------------------------------------
 
 # --- Admin Actions (Add, Edit, Delete) ---
 
-@app.post("/admin/add")
+# Messages for /admin?error=<code>; a fixed set so the query string can't put arbitrary text on the page
+ADMIN_ERRORS = {
+    "invalid_date": "Invalid date. The record was not added.",
+    "save_failed": "The record could not be saved. Please try again.",
+    "duplicate_checkin": "That person already has a finalized check-in on that day. The edit was not saved.",
+}
+
+@app.post("/admin/add", dependencies=[Depends(require_admin)])
 def admin_add_record(
     request: Request,
     user_name: str = Form(...),
@@ -280,37 +447,38 @@ def admin_add_record(
     custom_date: str = Form(...), # Expecting YYYY-MM-DDTHH:MM
     db: Session = Depends(get_db)
 ):
-    if request.cookies.get("admin_auth") != "super_secret_token":
-        return RedirectResponse(url="/admin/login", status_code=303)
+    try:
+        # Parse the datetime-local input (ISO 8601, YYYY-MM-DDTHH:MM)
+        dt_obj = datetime.fromisoformat(custom_date)
+    except ValueError:
+        return RedirectResponse(url="/admin?error=invalid_date", status_code=303)
+
+    # Convert local time input to UTC for storage
+    # Assuming admin is entering EST time, we convert to UTC
+    dt_est = dt_obj.replace(tzinfo=EST_ZONE)
+    dt_utc = dt_est.astimezone(timezone.utc)
 
     try:
-        # Parse the datetime-local input
-        dt_obj = datetime.strptime(custom_date, "%Y-%m-%dT%H:%M")
-        # Convert local time input to UTC for storage
-        # Assuming admin is entering EST time, we convert to UTC
-        est_zone = ZoneInfo("America/New_York")
-        dt_est = dt_obj.replace(tzinfo=est_zone)
-        dt_utc = dt_est.astimezone(timezone.utc)
-        
-        new_rec = Attendance(
-            user_name=user_name,
-            visit_reason=visit_reason,
-            business_line=business_line,
-            site=site,
-            timestamp_utc=dt_utc,
-            local_date=dt_est.strftime("%Y-%m-%d"),
-            event_type="check_in",
-            source="admin_manual",
-            is_valid=True
-        )
-        db.add(new_rec)
-        db.commit()
-    except Exception as e:
-        print(f"Error adding record: {e}")
+        bulk_insert_attendance(db, [{
+            "user_name": user_name,
+            "visit_reason": visit_reason,
+            "business_line": business_line,
+            "site": site,
+            "timestamp_utc": dt_utc,
+            "local_date": dt_est.date().isoformat(),
+            "event_type": "check_in",
+            "source": "admin_manual",
+            "is_valid": True
+        }])
+    except SQLAlchemyError as e:
+        db.rollback()
+        logger.error("Error adding record: %s", e)
+        return RedirectResponse(url="/admin?error=save_failed", status_code=303)
     
+    metrics_router.clear_metrics_cache() # This worker only; others catch up within METRICS_CACHE_TTL
     return RedirectResponse(url="/admin", status_code=303)
 
-@app.post("/admin/edit")
+@app.post("/admin/edit", dependencies=[Depends(require_admin)])
 def admin_edit_record(
     request: Request,
     record_id: int = Form(...),
@@ -321,52 +489,49 @@ def admin_edit_record(
     custom_date: str = Form(...),
     db: Session = Depends(get_db)
 ):
-    if request.cookies.get("admin_auth") != "super_secret_token":
-        return RedirectResponse(url="/admin/login", status_code=303)
-
-    rec = db.get(Attendance, record_id)
-    if rec:
-        rec.user_name = user_name
-        rec.visit_reason = visit_reason
-        rec.business_line = business_line
-        rec.site = site
-
-        # --- UPDATE TIMESTAMP ---
-        try:
-            # Parse the datetime-local input (YYYY-MM-DDTHH:MM)
-            dt_obj = datetime.strptime(custom_date, "%Y-%m-%dT%H:%M")
-            
-            # Assume Admin is entering EST time, convert to UTC for storage
-            try:
-                est_zone = ZoneInfo("America/New_York")
-            except:
-                est_zone = timezone.utc
-            
-            dt_est = dt_obj.replace(tzinfo=est_zone)
-            dt_utc = dt_est.astimezone(timezone.utc)
-            
-            rec.timestamp_utc = dt_utc
-            rec.local_date = dt_est.strftime("%Y-%m-%d") # Update local_date too for grouping
-        except ValueError:
-            pass # Keep old date if format is wrong
-        # ------------------------
+    # Single UPDATE by primary key; no need to load the row first
+    values = {
+        "user_name": user_name,
+        "visit_reason": visit_reason,
+        "business_line": business_line,
+        "site": site,
+    }
+
+    # --- UPDATE TIMESTAMP ---
+    try:
+        # Parse the datetime-local input (YYYY-MM-DDTHH:MM)
+        dt_obj = datetime.fromisoformat(custom_date)
+        
+        # Assume Admin is entering EST time, convert to UTC for storage
+        dt_est = dt_obj.replace(tzinfo=EST_ZONE)
+        dt_utc = dt_est.astimezone(timezone.utc)
+        
+        values["timestamp_utc"] = dt_utc
+        values["local_date"] = dt_est.date().isoformat() # Update local_date too for grouping
+    except ValueError:
+        pass # Keep old date if format is wrong
+    # ------------------------
 
+    try:
+        db.execute(update(Attendance).where(Attendance.id == record_id).values(**values))
         db.commit()
+    except IntegrityError:
+        # Moving a finalized check-in onto a day the user already has one violates uq_one_checkin_per_day
+        db.rollback()
+        return RedirectResponse(url="/admin?error=duplicate_checkin", status_code=303)
     
+    metrics_router.clear_metrics_cache() # This worker only; others catch up within METRICS_CACHE_TTL
     return RedirectResponse(url="/admin", status_code=303)
 
-@app.post("/admin/delete")
+@app.post("/admin/delete", dependencies=[Depends(require_admin)])
 def admin_delete_record(
     request: Request,
     record_id: int = Form(...),
     db: Session = Depends(get_db)
 ):
-    if request.cookies.get("admin_auth") != "super_secret_token":
-        return RedirectResponse(url="/admin/login", status_code=303)
-
-    rec = db.get(Attendance, record_id)
-    if rec:
-        db.delete(rec)
-        db.commit()
+    # Single DELETE by primary key; no need to load the row first
+    db.execute(delete(Attendance).where(Attendance.id == record_id))
+    db.commit()
     
+    metrics_router.clear_metrics_cache() # This worker only; others catch up within METRICS_CACHE_TTL
     return RedirectResponse(url="/admin", status_code=303)
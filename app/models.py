@@ -1,5 +1,5 @@
 from datetime import datetime, timezone
-from sqlalchemy import Column, Integer, String, DateTime, Float, Boolean, Text, CheckConstraint
+from sqlalchemy import Column, Integer, String, DateTime, Float, Boolean, Text, CheckConstraint, Index, and_, insert
 from .database import Base
 
 class Employee(Base):
@@ -46,7 +46,50 @@ class Attendance(Base):
     geo_lat = Column(Float)
     geo_lon = Column(Float)
     signature_path = Column(String(256))
+    checkin_nonce = Column(String(32), nullable=True) # Random id from the scan token; lets /finalize recognise a replay
     is_valid = Column(Boolean, nullable=False, default=True)
     notes = Column(Text)
     updated_at_utc = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc),
-                            onupdate=lambda: datetime.now(timezone.utc), nullable=False)
\ No newline at end of file
+                            onupdate=lambda: datetime.now(timezone.utc), nullable=False)
+
+# Partial index matching the admin dashboard's filter + sort (valid check-ins, newest first)
+Index(
+    "attendance_checkin_ts",
+    Attendance.timestamp_utc.desc(),
+    postgresql_where=and_(Attendance.event_type == "check_in", Attendance.is_valid == True),
+    sqlite_where=and_(Attendance.event_type == "check_in", Attendance.is_valid == True),
+)
+
+# Partial index for the calendar day panel: one local_date's valid check-ins, in time order
+Index(
+    "ix_att_localdate_checkin",
+    Attendance.local_date,
+    Attendance.timestamp_utc,
+    postgresql_where=and_(Attendance.event_type == "check_in", Attendance.is_valid == True),
+    sqlite_where=and_(Attendance.event_type == "check_in", Attendance.is_valid == True),
+)
+
+# At most one finalized check-in per user per local day; concurrent finalizes race on this index
+one_checkin_per_day = and_(
+    Attendance.event_type == "check_in",
+    Attendance.is_valid == True,
+    Attendance.source == "qr_scan_finalized",
+)
+Index(
+    "uq_one_checkin_per_day",
+    Attendance.user_email,
+    Attendance.local_date,
+    unique=True,
+    postgresql_where=one_checkin_per_day,
+    sqlite_where=one_checkin_per_day,
+)
+
+# Each scan token is redeemed at most once; rows without a nonce (NULL) never conflict
+Index("uq_attendance_checkin_nonce", Attendance.checkin_nonce, unique=True)
+
+def bulk_insert_attendance(db, records):
+    """Inserts attendance rows (a list of column dicts) in one executemany round trip and commits."""
+    if not records:
+        return
+    db.execute(insert(Attendance), records)
+    db.commit()
\ No newline at end of file
@@ -1,28 +1,55 @@
-from fastapi.templating import Jinja2Templates
 from fastapi import APIRouter, Request, Depends, HTTPException, Form
 from fastapi.responses import HTMLResponse, RedirectResponse
-from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse, RedirectResponse # Make sure RedirectResponse is imported
+from sqlalchemy import select
 from sqlalchemy.orm import Session
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 from typing import Optional, Dict
-from datetime import datetime, timezone, date # Add date
-from zoneinfo import ZoneInfo # Add ZoneInfo
+from datetime import datetime, timezone, date, time, timedelta # Add date
+import logging
+from uuid import uuid4
 
-from ..database import get_db
+from ..database import get_db, upsert_insert, skip_commit_flush
 from ..models import Attendance
-from ..settings import settings
+from ..security import create_checkin_token, read_checkin_token
+from ..settings import settings, EST_ZONE
+from ..templating import templates
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
-templates = Jinja2Templates(directory="app/templates")
+
+# Rendered on every check-in; templates are precompiled at import, so this is the compiled object
+scan_template = templates.get_template("scan.html")
+
+# --- EST date of a check-in, cached for the current day ---
+# (day start UTC, next day start UTC, "YYYY-MM-DD"); swapped as one tuple so threads never see a torn value
+_local_date_cache = (datetime.min.replace(tzinfo=timezone.utc), datetime.min.replace(tzinfo=timezone.utc), "")
+
+def est_local_date(timestamp_utc):
+    """Returns the EST "YYYY-MM-DD" for a UTC timestamp, recomputing only when it leaves the cached day."""
+    global _local_date_cache
+    day_start, day_end, date_str = _local_date_cache
+    if day_start <= timestamp_utc < day_end:
+        return date_str
+
+    local_day = timestamp_utc.astimezone(EST_ZONE).date()
+    day_start = datetime.combine(local_day, time.min, tzinfo=EST_ZONE).astimezone(timezone.utc)
+    day_end = datetime.combine(local_day + timedelta(days=1), time.min, tzinfo=EST_ZONE).astimezone(timezone.utc)
+    _local_date_cache = (day_start, day_end, local_day.isoformat())
+    return _local_date_cache[2]
 
 # --- Pydantic Schemas for the /finalize endpoint ---
 
 class GeoPayload(BaseModel):
+    model_config = ConfigDict(extra="ignore", frozen=True)
+
     lat: Optional[float] = None
     lon: Optional[float] = None
 
 class FinalizePayload(BaseModel):
+    # Unknown client fields are dropped, not stored; the payload is read-only once validated
+    model_config = ConfigDict(extra="ignore", frozen=True)
+
     token: str
     site: str
     deviceId: Optional[str] = None
@@ -36,7 +63,7 @@ class FinalizePayload(BaseModel):
 # --- Routes ---
 
 @router.get("/scan", response_class=HTMLResponse)
-def scan(request: Request, db: Session = Depends(get_db), site: Optional[str] = None):
+def scan(request: Request, site: Optional[str] = None):
     user_name = None
     user_email = None
 
@@ -54,39 +81,12 @@ def scan(request: Request, db: Session = Depends(get_db), site: Optional[str] =
     if site_code not in settings.sites:
         site_code = settings.default_site
 
-    # --- RESTORE: Create a provisional record ---
-    now_utc = datetime.now(timezone.utc)
-    try:
-        est_zone = ZoneInfo("America/New_York")
-        now_est = now_utc.astimezone(est_zone)
-        local_date_str = now_est.strftime("%Y-%m-%d")
-    except Exception:
-        local_date_str = now_utc.strftime("%Y-%m-%d")
+    # The token carries the scan context and time; the row is only written by /finalize.
+    # The nonce is stored with that row, so reposting the same token is recognised as a replay.
+    token = create_checkin_token({"site": site_code, "email": user_email, "name": user_name, "nonce": uuid4().hex})
 
-    # Remove previous check for existing checkin here, it should happen in /finalize if needed
-
-    rec = Attendance(
-        site=site_code,
-        event_type="check_in",
-        is_valid=True, # Mark as provisional? Could add a status field later.
-        source="qr_scan_provisional",
-        timestamp_utc=now_utc,
-        local_date=local_date_str,
-        user_name=user_name,
-        user_email=user_email
-    )
-    db.add(rec)
-    db.commit()
-    db.refresh(rec) # Get the generated ID
-    # --- END RESTORE ---
-
-    token = str(rec.id) # Use the DB ID as the token
-
-    # Render the scan page for the user to submit
-    return templates.TemplateResponse(
-        "scan.html",
-        {"request": request, "token": token, "site": site_code}
-    )
+    # Render the scan page for the user to submit (straight from the precompiled template)
+    return HTMLResponse(scan_template.render(request=request, token=token, site=site_code))
 
 @router.get("/visitor", response_class=HTMLResponse)
 def visitor_checkin_page(request: Request, site: str = "greensboro"):
@@ -107,12 +107,7 @@ def visitor_submit(
 
     # 2. Calculate timestamps
     now_utc = datetime.now(timezone.utc)
-    try:
-        est_zone = ZoneInfo("America/New_York")
-        now_est = now_utc.astimezone(est_zone)
-        local_date_str = now_est.strftime("%Y-%m-%d")
-    except Exception:
-        local_date_str = now_utc.strftime("%Y-%m-%d")
+    local_date_str = est_local_date(now_utc)
 
     # 3. Create Attendance Record
     rec = Attendance(
@@ -128,6 +123,7 @@ def visitor_submit(
         business_line=business_line, # <-- SAVE IT HERE
     )
     
+    skip_commit_flush(db)
     db.add(rec)
     db.commit()
 
@@ -135,85 +131,62 @@ def visitor_submit(
     return RedirectResponse(url="/checkin-success", status_code=303)
 
 @router.post("/finalize")
-async def finalize(payload: FinalizePayload, request: Request, db: Session = Depends(get_db)): # Add request parameter
-    print(f"--- /finalize received payload: {payload.model_dump()}") # <-- ADD THIS
-    try:
-        pk = int(payload.token)
-    except (TypeError, ValueError):
-        raise HTTPException(status_code=400, detail="Invalid token")
-
-    rec = db.get(Attendance, pk)
-    if not rec:
-        raise HTTPException(status_code=404, detail="Token not found")
-
-    # --- ADD DUPLICATE CHECK HERE ---
-    user_email = request.session.get("user", {}).get("email") # Get email from session
-
-    if user_email and rec.event_type == "check_in": # Only check for check-ins if we have email
-        try:
-            est_zone = ZoneInfo("America/New_York")
-            today_est_str = datetime.now(est_zone).strftime("%Y-%m-%d")
-
-            # Check for OTHER finalized check-ins today by this user
-            existing_finalized_checkin = db.query(Attendance).filter(
-                Attendance.id != pk, # Exclude the current provisional record
-                Attendance.local_date == today_est_str,
-                Attendance.user_email == user_email,
-                Attendance.event_type == "check_in",
-                Attendance.is_valid == True,
-                # Check if the source indicates it was finalized
-                Attendance.source == "qr_scan_finalized" 
-            ).first()
-
-            if existing_finalized_checkin:
-                print(f"User {user_email} trying to finalize, but already checked in today ({today_est_str}). Invalidating provisional record.")
-                # Optionally invalidate the provisional record instead of finalizing
-                rec.is_valid = False 
-                rec.notes = "Attempted duplicate check-in."
-                rec.source = "qr_scan_duplicate"
-                db.add(rec)
-                db.commit()
-                # Redirect to already checked in page
-                # You'll need RedirectResponse imported: from fastapi.responses import RedirectResponse
-                # return RedirectResponse(url="/already-checked-in", status_code=303) 
-                # OR return an error/message
-                return {"ok": False, "message": "Already checked in today."}
-
-        except Exception as e:
-            print(f"Error checking for existing finalized check-in: {e}")
-            # Decide how to handle - maybe allow finalize anyway? For now, proceed.
-    # --------------------------------
-
-    # --- Finalize the record ---
-    print(f"Finalizing check-in for {rec.user_email or rec.user_name}, ID: {pk}")
-    rec.device_local_id = payload.deviceId or rec.device_local_id
-    rec.user_agent = payload.userAgent
-    rec.source = "qr_scan_finalized" 
-
-    # --- ADD THIS LINE ---
-    rec.visit_reason = payload.visit_reason # Assign the reason from the payload
-    # ---------------------
-    rec.business_line = payload.business_line
-
-    if payload.geo:
-        rec.geo_lat = payload.geo.lat
-        rec.geo_lon = payload.geo.lon
-    
-    if rec.is_valid is None:
-         rec.is_valid = True
+def finalize(payload: FinalizePayload, request: Request, db: Session = Depends(get_db)): # Add request parameter
+    logger.debug("/finalize received payload: %r", payload) # repr only built when DEBUG is on
+    scan_data, scanned_at = read_checkin_token(payload.token)
+
+    # --- Build the check-in (timestamped at scan time, as before) ---
+    record = {
+        "site": scan_data["site"],
+        "event_type": "check_in",
+        "is_valid": True,
+        "source": "qr_scan_finalized",
+        "timestamp_utc": scanned_at,
+        "local_date": est_local_date(scanned_at),
+        "user_name": scan_data["name"],
+        "user_email": scan_data["email"],
+        "visit_reason": payload.visit_reason,
+        "business_line": payload.business_line,
+        "device_local_id": payload.deviceId,
+        "user_agent": payload.userAgent,
+        "geo_lat": payload.geo.lat if payload.geo else None,
+        "geo_lon": payload.geo.lon if payload.geo else None,
+        "checkin_nonce": scan_data.get("nonce"), # Tokens minted before nonces existed carry none
+    }
+    logger.debug("Finalizing check-in for %s", record["user_email"] or record["user_name"])
+
+    # One round trip in the common case. No id comes back when either unique index already
+    # holds a row: this token's nonce (a replay) or today's check-in (uq_one_checkin_per_day).
+    stmt = upsert_insert(Attendance).values(**record).on_conflict_do_nothing().returning(Attendance.id)
 
     try: # Add try/except around commit for better error logging
-        db.add(rec)
+        skip_commit_flush(db)
+        new_id = db.execute(stmt).scalar()
+        if new_id is not None:
+            checked_in = True
+        else:
+            # A replayed token gets the answer its first post got, without writing another row
+            first_source = None
+            if record["checkin_nonce"]:
+                first_source = db.execute(
+                    select(Attendance.source).where(Attendance.checkin_nonce == record["checkin_nonce"])
+                ).scalar()
+            if first_source is not None:
+                logger.info("Replayed check-in token for %s; returning the original result.", record["user_email"] or record["user_name"])
+                checked_in = first_source == "qr_scan_finalized"
+            else:
+                # Already checked in today: keep the attempt for auditing, but as an invalid row
+                logger.info("%s already checked in today. Recording invalid duplicate.", record["user_email"])
+                record.update(is_valid=False, notes="Attempted duplicate check-in.", source="qr_scan_duplicate")
+                db.execute(upsert_insert(Attendance).values(**record).on_conflict_do_nothing())
+                checked_in = False
         db.commit()
 
-        # --- ADD REFRESH AND LOGGING ---
-        db.refresh(rec) 
-        print(f"Record AFTER commit & refresh: ID={rec.id}, Name={rec.user_name}, Reason={rec.visit_reason}")
-        # -------------------------------
-
     except Exception as e:
         db.rollback()
-        print(f"ERROR during finalize commit: {e}")
+        logger.error("Error during finalize commit: %s", e)
         raise HTTPException(status_code=500, detail="Database commit failed during finalize.")
 
-    return {"ok": True, "token": payload.token}
\ No newline at end of file
+    if not checked_in:
+        return {"ok": False, "message": "Already checked in today."}
+    return {"ok": True, "token": payload.token}
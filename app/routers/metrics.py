@@ -1,160 +1,238 @@
 # app/routers/metrics.py
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Response
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import func, cast, extract # Import necessary SQLAlchemy functions
-from datetime import datetime, timedelta, timezone, date # Import date/time functions
-import re # Import regular expression module for date validation
+from sqlalchemy import select, func, bindparam, literal_column, Date # Import necessary SQLAlchemy functions
+from datetime import datetime, timedelta, timezone, date, time # Import date/time functions
+import orjson
+import threading
+from time import monotonic
 
-from ..database import get_db
+from ..database import engine, get_db, SessionLocal
 from ..models import Attendance
+from ..security import require_admin
 
 from collections import defaultdict
 
 router = APIRouter(
     prefix="/api/metrics", # Add a prefix for all routes in this file
-    tags=["metrics"]        # Tag for API documentation
+    tags=["metrics"],       # Tag for API documentation
+    dependencies=[Depends(require_admin)], # Admin-only; checked before get_db checks out a connection
 )
 
+# --- Per-worker TTL cache for the chart endpoints ---
+# Each worker process has its own copy, and an admin edit only clears the worker that handled it.
+# Other workers can serve the old numbers for up to METRICS_CACHE_TTL, and the browser may keep such a
+# response for another max-age, so a chart can trail an edit by up to twice the TTL.
+METRICS_CACHE_TTL = 60 # Seconds a result is reused, for current and past periods alike
+METRICS_CACHE_MAX_ENTRIES = 256 # Any valid YYYY-MM is a key, so bound the dict
+BROWSER_CACHE_CONTROL = f"private, max-age={METRICS_CACHE_TTL}" # Admin-only data: never in shared caches
+_metrics_cache = {} # key -> (expires_at, result), oldest first
+_metrics_cache_lock = threading.Lock() # Handlers run concurrently on threadpool workers
+
+def _cache_get(key):
+    with _metrics_cache_lock:
+        entry = _metrics_cache.get(key)
+    if entry and entry[0] > monotonic():
+        return entry[1]
+    return None
+
+def _cache_put(key, result):
+    now = monotonic()
+    with _metrics_cache_lock:
+        for stale_key in [k for k, (expires_at, _) in _metrics_cache.items() if expires_at <= now]:
+            _metrics_cache.pop(stale_key, None)
+        _metrics_cache.pop(key, None) # Re-inserted at the end, so dict order stays oldest first
+        while len(_metrics_cache) >= METRICS_CACHE_MAX_ENTRIES:
+            _metrics_cache.pop(next(iter(_metrics_cache)), None)
+        _metrics_cache[key] = (now + METRICS_CACHE_TTL, result)
+
+def clear_metrics_cache():
+    """Drops this worker's cached chart results; called after admin add/edit/delete."""
+    with _metrics_cache_lock:
+        _metrics_cache.clear()
+# ----------------------------------------------------
+
+# --- Statements built once at import; handlers only bind parameters ---
+# A fixed statement object lets SQLAlchemy reuse its compiled SQL from the cache on every call.
+# UTC day bucket. Postgres's date() of a timestamptz uses the session TimeZone, so shift to UTC first;
+# SQLite stores the UTC wall time already.
+if engine.dialect.name == "postgresql":
+    # Inline literal, so SELECT and GROUP BY render the identical expression under any driver
+    checkin_timestamp_utc = func.timezone(literal_column("'UTC'"), Attendance.timestamp_utc)
+else:
+    checkin_timestamp_utc = Attendance.timestamp_utc
+checkin_date = func.date(checkin_timestamp_utc, type_=Date).label("checkin_date")
+daily_checkins_stmt = (
+    select(checkin_date, func.count(Attendance.id).label("checkins"))
+    .where(
+        Attendance.timestamp_utc >= bindparam("start_dt"), # Half-open UTC range on the raw column,
+        Attendance.timestamp_utc < bindparam("end_dt"),    # so the attendance_checkin_ts index can serve it
+        Attendance.event_type == "check_in",
+        Attendance.is_valid == True
+    )
+    .group_by(checkin_date)
+    .order_by(checkin_date)
+)
+# -----------------------------------------------------------------------
+
 @router.get("/daily_checkins_last_week")
-def get_daily_checkins_last_week(db: Session = Depends(get_db)):
+def get_daily_checkins_last_week(response: Response, db: Session = Depends(get_db)):
     """
     Counts the number of valid check-ins per day for the past 7 days (including today).
     Returns data formatted for Chart.js.
     """
     today = datetime.now(timezone.utc).date()
+    response.headers["Cache-Control"] = BROWSER_CACHE_CONTROL
+    cache_key = ("daily", today) # Keyed on the day so the window moves at midnight
+    cached = _cache_get(cache_key)
+    if cached is not None:
+        return cached # The session never checked out a connection
     seven_days_ago = today - timedelta(days=6) # Calculate start date
 
-    # Query the database: Count Attendance records, group by date
-    results = (
-        db.query(
-            cast(Attendance.timestamp_utc, date).label("checkin_date"), # Extract date part
-            func.count(Attendance.id).label("count")                 # Count records
-        )
-        .filter(
-            cast(Attendance.timestamp_utc, date) >= seven_days_ago, # Filter by date range
-            cast(Attendance.timestamp_utc, date) <= today,
-            Attendance.event_type == "check_in",                    # Only count check-ins
-            Attendance.is_valid == True                             # Only count valid entries
-        )
-        .group_by("checkin_date")                                  # Group results by date
-        .order_by("checkin_date")                                  # Order by date
-        .all()
-    )
+    start_dt = datetime.combine(seven_days_ago, time.min, tzinfo=timezone.utc)
+    end_dt = datetime.combine(today + timedelta(days=1), time.min, tzinfo=timezone.utc)
+    results = db.execute(daily_checkins_stmt, {"start_dt": start_dt, "end_dt": end_dt}).all()
 
     # Format data for Chart.js (labels = dates, data = counts)
     # Ensure all days in the range are present, even if count is 0
-    date_map = {r.checkin_date: r.count for r in results}
-    labels = [(seven_days_ago + timedelta(days=i)).strftime("%Y-%m-%d") for i in range(7)]
-    data = [date_map.get(datetime.strptime(label, "%Y-%m-%d").date(), 0) for label in labels]
-    
-    return {"labels": labels, "data": data}
+    date_map = {r.checkin_date: r.checkins for r in results}
+    days = [seven_days_ago + timedelta(days=i) for i in range(7)]
+    labels = [day.isoformat() for day in days] # "YYYY-MM-DD"
+    data = [date_map.get(day, 0) for day in days]
+
+    result = {"labels": labels, "data": data}
+    _cache_put(cache_key, result)
+    return result
+
+STREAM_BATCH_ROWS = 500 # Rows fetched and encoded per streamed chunk
+
+# Only the columns the day panel returns; no ORM objects or Text columns
+attendance_for_date_columns = (
+    Attendance.id,
+    Attendance.timestamp_utc,
+    Attendance.local_date,
+    Attendance.site,
+    Attendance.event_type,
+    Attendance.user_name,
+    Attendance.user_email,
+    Attendance.visit_reason,
+    Attendance.device_local_id,
+    Attendance.geo_lat,
+    Attendance.geo_lon,
+)
+attendance_for_date_stmt = select(*attendance_for_date_columns).where(
+    Attendance.local_date == bindparam("local_date"),
+    Attendance.event_type == "check_in",
+    Attendance.is_valid == True
+).order_by(Attendance.timestamp_utc.asc()) # Order by time ascending for the panel display
+
+def _stream_attendance_for_date(date_str):
+    """Yields the day's check-ins as a JSON array, one chunk per batch of rows."""
+    # FastAPI closes the request's get_db session before a streamed body is sent, so open our own
+    db = SessionLocal()
+    try:
+        rows = db.execute(
+            attendance_for_date_stmt.execution_options(yield_per=STREAM_BATCH_ROWS),
+            {"local_date": date_str},
+        ).mappings()
+
+        yield b"["
+        separator = b""
+        batch = []
+        for row in rows:
+            batch.append(orjson.dumps(dict(row))) # Column names are the JSON keys
+            if len(batch) == STREAM_BATCH_ROWS:
+                yield separator + b",".join(batch)
+                separator, batch = b",", []
+        if batch:
+            yield separator + b",".join(batch)
+        yield b"]"
+    finally:
+        db.close()
 
 # --- ADD NEW ENDPOINT ---
-@router.get("/attendance/{date_str}") 
-async def get_attendance_for_date(date_str: str, db: Session = Depends(get_db)):
+@router.get("/attendance/{date_str}")
+def get_attendance_for_date(date_str: str):
     """
     Fetches all valid check-in records for a specific date (YYYY-MM-DD).
+    Streams a JSON array so the first rows go out before the whole day is read.
     """
-    # Basic validation for the date string format
-    if not re.match(r"^\d{4}-\d{2}-\d{2}$", date_str):
-        raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD.")
-
     try:
-        # Attempt to parse the date to ensure it's valid, though we query by string
-        requested_date = date.fromisoformat(date_str) 
+        # fromisoformat is the whole format check; no separate regex pass
+        requested_date = date.fromisoformat(date_str)
     except ValueError:
-        raise HTTPException(status_code=400, detail="Invalid date value.")
-
-    # Query the database for records matching the local_date string
-    records = db.query(Attendance).filter(
-        Attendance.local_date == date_str,
+        raise HTTPException(status_code=400, detail="Invalid date. Use YYYY-MM-DD.")
+
+    return StreamingResponse(_stream_attendance_for_date(requested_date.isoformat()), media_type="application/json")
+
+# Check-in counts per (reason, business line) for a UTC range, aggregated in SQL
+reason_key = func.coalesce(func.nullif(Attendance.visit_reason, ""), "N/A").label("reason_key") # Group None/empty as "N/A"
+business_line_key = func.coalesce(func.nullif(Attendance.business_line, ""), "N/A").label("business_line_key")
+monthly_group_counts_stmt = select(
+        reason_key,
+        business_line_key,
+        func.count().label("checkins")
+    ).where(
+        Attendance.timestamp_utc >= bindparam("month_start"),
+        Attendance.timestamp_utc < bindparam("month_end"),
         Attendance.event_type == "check_in",
         Attendance.is_valid == True
-    ).order_by(Attendance.timestamp_utc.asc()).all() # Order by time ascending for the panel display
-
-    # (Optional) Convert SQLAlchemy objects to dictionaries for JSON response
-    # This avoids potential issues with lazy loading or complex objects
-    results = [
-        {
-            "id": rec.id,
-            "timestamp_utc": rec.timestamp_utc,
-            "local_date": rec.local_date,
-            "site": rec.site,
-            "event_type": rec.event_type,
-            "user_name": rec.user_name,
-            "user_email": rec.user_email,
-            "visit_reason": rec.visit_reason,
-            "device_local_id": rec.device_local_id,
-            "geo_lat": rec.geo_lat,
-            "geo_lon": rec.geo_lon
-        } 
-        for rec in records
-    ]
-
-    return results
+    ).group_by(reason_key, business_line_key)
 
 @router.get("/monthly_summary/{year_month}")
-async def get_monthly_summary(year_month: str, db: Session = Depends(get_db)):
+def get_monthly_summary(year_month: str, response: Response, db: Session = Depends(get_db)):
     """
     Calculates total check-ins and breakdown by reason for a given month (YYYY-MM).
     """
-    # Validate format YYYY-MM
-    if not re.match(r"^\d{4}-\d{2}$", year_month):
-        raise HTTPException(status_code=400, detail="Invalid month format. Use YYYY-MM.")
-
+    # Validate format YYYY-MM; strptime rejects whitespace, and the length check rejects one-digit months
     try:
-        year, month = map(int, year_month.split('-'))
-        # Basic validation for month value
-        if not (1 <= month <= 12):
-             raise ValueError("Month out of range")
+        if len(year_month) != 7:
+            raise ValueError("Expected YYYY-MM")
+        # Half-open UTC range for the month, so the attendance_checkin_ts index can serve it
+        month_start = datetime.strptime(year_month, "%Y-%m").replace(tzinfo=timezone.utc)
+        year, month = month_start.year, month_start.month
+        month_end = datetime(year + (month == 12), month % 12 + 1, 1, tzinfo=timezone.utc) # Fails for 9999-12
     except ValueError:
-        raise HTTPException(status_code=400, detail="Invalid year or month value.")
-
-    # Query for total count and reason breakdown for the given month
-    # We filter using date functions directly in the query
-    # Query for records in the given month
-    records_in_month = db.query(
-            Attendance.visit_reason,
-            Attendance.business_line # Also query business_line
-        ).filter(
-            extract('year', Attendance.timestamp_utc) == year,
-            extract('month', Attendance.timestamp_utc) == month,
-            Attendance.event_type == "check_in",
-            Attendance.is_valid == True
-        ).all() 
-
-    total_checkins = len(records_in_month)
-    # --- Calculate Breakdowns ---
+        raise HTTPException(status_code=400, detail="Invalid month. Use YYYY-MM.")
+
+    response.headers["Cache-Control"] = BROWSER_CACHE_CONTROL
+    cache_key = ("monthly", year_month)
+    cached = _cache_get(cache_key)
+    if cached is not None:
+        return cached
+
+    group_counts = db.execute(
+        monthly_group_counts_stmt, {"month_start": month_start, "month_end": month_end}
+    ).all()
+
+    # --- Calculate Breakdowns (a few dozen groups at most) ---
     reason_counts = defaultdict(int)
     business_line_counts = defaultdict(int)
-    
-    for record in records_in_month:
-        reason_key = record.visit_reason if record.visit_reason else "N/A"
-        business_line_key = record.business_line if record.business_line else "N/A"
-        reason_counts[reason_key] += 1
-        business_line_counts[business_line_key] += 1
+    total_checkins = 0
+
+    for group in group_counts:
+        reason_counts[group.reason_key] += group.checkins
+        business_line_counts[group.business_line_key] += group.checkins
+        total_checkins += group.checkins
     # ---------------------------
 
     # --- Format Breakdowns with Percentages ---
     def format_breakdown(counts_dict, total):
-        formatted = {}
-        if total > 0:
-            for key, count in counts_dict.items():
-                percent = round((count / total) * 100, 1)
-                formatted[key] = f"{count} ({percent}%)"
-        else:
-            for key, count in counts_dict.items():
-                 formatted[key] = f"{count} (0.0%)"
-        return formatted
+        # Every key has count >= 1, so total is never 0 when there is anything to format
+        scale = 100.0 / total if total else 0.0
+        return {key: f"{count} ({round(count * scale, 1)}%)" for key, count in counts_dict.items()}
 
     reason_breakdown_percent = format_breakdown(reason_counts, total_checkins)
     business_line_breakdown_percent = format_breakdown(business_line_counts, total_checkins) # Format business line
     # ----------------------------------------
 
-    return {
+    result = {
         "month": year_month,
         "total_checkins": total_checkins,
         "reason_breakdown": reason_breakdown_percent,
         "business_line_breakdown": business_line_breakdown_percent # <-- RETURN NEW DATA
-    }
\ No newline at end of file
+    }
+    _cache_put(cache_key, result)
+    return result
@@ -1,19 +1,99 @@
 # app/security.py
+import hashlib
+import threading
 import bcrypt
+from time import monotonic
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
+from fastapi import HTTPException, Request
+from itsdangerous import BadSignature, SignatureExpired, URLSafeTimedSerializer
+
+from .settings import settings
+
+# Argon2id for new hashes; its C implementation releases the GIL while hashing.
+# OWASP's minimum profile (19 MiB, t=2, p=1): roughly 4x cheaper than the library default.
+# Hashes made with the old default parameters are upgraded on next login via password_needs_rehash.
+password_hasher = PasswordHasher(time_cost=2, memory_cost=19456, parallelism=1)
+
+# Recent successful verifications, so a repeated login skips the deliberately slow hash.
+# Keys are keyed BLAKE2b digests: the cache never holds a password or a hash in the clear.
+VERIFY_CACHE_TTL = 60 # Seconds
+VERIFY_CACHE_MAX_ENTRIES = 1024
+_verify_cache_key = hashlib.blake2b(settings.secret_key.encode("utf-8"), person=b"pw-verify-cache").digest()
+_verified = {} # digest -> expires_at (monotonic), oldest first
+_verified_lock = threading.Lock() # Logins verify concurrently on threadpool workers; never held while hashing
+
+def _verify_digest(plain_password, hashed_password):
+    h = hashlib.blake2b(key=_verify_cache_key, digest_size=32)
+    h.update(hashed_password.encode("utf-8"))
+    h.update(b"\0")
+    h.update(plain_password.encode("utf-8"))
+    return h.digest()
 
 def verify_password(plain_password, hashed_password):
+    digest = _verify_digest(plain_password, hashed_password)
+    with _verified_lock:
+        expires_at = _verified.get(digest)
+        if expires_at is not None:
+            if expires_at > monotonic():
+                return True
+            _verified.pop(digest, None)
+    if not _verify_uncached(plain_password, hashed_password):
+        return False # Failures are never cached
+    with _verified_lock:
+        _verified.pop(digest, None) # Re-inserted at the end, so dict order stays oldest first
+        while len(_verified) >= VERIFY_CACHE_MAX_ENTRIES:
+            _verified.pop(next(iter(_verified)), None) # Evict the oldest entry
+        _verified[digest] = monotonic() + VERIFY_CACHE_TTL
+    return True
+
+def _verify_uncached(plain_password, hashed_password):
     # Check if the password matches the hash
+    if hashed_password.startswith("$argon2"):
+        try:
+            return password_hasher.verify(hashed_password, plain_password)
+        except (VerificationError, InvalidHashError):
+            return False
+    # Legacy bcrypt hashes ("$2b$...") from before the switch to Argon2
     # Both must be encoded to bytes for bcrypt
-    # hashed_password might come from DB as string, so we encode it
     return bcrypt.checkpw(
         plain_password.encode('utf-8'), 
         hashed_password.encode('utf-8')
     )
 
 def get_password_hash(password):
-    # Generate a salt and hash the password
-    # Returns a string decoded from bytes
-    pwd_bytes = password.encode('utf-8')
-    salt = bcrypt.gensalt()
-    hashed = bcrypt.hashpw(pwd_bytes, salt)
-    return hashed.decode('utf-8')
\ No newline at end of file
+    # Argon2id hash with a random salt; the result is an ASCII string
+    return password_hasher.hash(password)
+
+def password_needs_rehash(hashed_password):
+    # True for legacy bcrypt hashes or Argon2 hashes made with older parameters
+    if not hashed_password.startswith("$argon2"):
+        return True
+    return password_hasher.check_needs_rehash(hashed_password)
+
+def require_admin(request: Request):
+    # Dependency for admin routes: redirect to the admin login unless the session is flagged admin.
+    # The session cookie is already HMAC-verified by SessionMiddleware, so this is a dict lookup.
+    if not request.session.get("is_admin"):
+        raise HTTPException(status_code=303, headers={"Location": "/admin/login"})
+
+# Signed, time-limited check-in tokens: /scan mints one, /finalize redeems it
+CHECKIN_TOKEN_MAX_AGE = 1800 # Seconds a scan page stays valid
+CHECKIN_TOKEN_MAX_LENGTH = 2048 # Longest name + email still signs well under this
+checkin_token_serializer = URLSafeTimedSerializer(settings.secret_key, salt="checkin-token")
+
+def create_checkin_token(data):
+    # Signs the scan context (site, user) with the issue time; no DB row is needed
+    return checkin_token_serializer.dumps(data)
+
+def read_checkin_token(token):
+    # Returns (data, issued_at_utc), or raises 400 if the token was forged, altered or has expired
+    if not token or len(token) > CHECKIN_TOKEN_MAX_LENGTH:
+        # Reject junk before any base64/HMAC work or exception handling
+        raise HTTPException(status_code=400, detail="Invalid token")
+    try:
+        return checkin_token_serializer.loads(token, max_age=CHECKIN_TOKEN_MAX_AGE, return_timestamp=True)
+    except SignatureExpired:
+        raise HTTPException(status_code=400, detail="Token expired")
+    except BadSignature:
+        raise HTTPException(status_code=400, detail="Invalid token")
@@ -0,0 +1,31 @@
+# app/templating.py
+
+import os
+import tempfile
+from pathlib import Path
+
+from fastapi.templating import Jinja2Templates
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+
+from .settings import settings
+
+TEMPLATES_DIR = Path(__file__).resolve().parent / "templates"
+
+# Compiled template bytecode survives worker restarts, so a fresh worker skips recompiling
+BYTECODE_CACHE_DIR = Path(tempfile.gettempdir()) / "greenville-checkin-jinja"
+BYTECODE_CACHE_DIR.mkdir(exist_ok=True)
+
+# One shared environment for main and all routers
+env = Environment(
+    loader=FileSystemLoader(os.fspath(TEMPLATES_DIR)),
+    autoescape=True,
+    auto_reload=settings.debug, # Skip per-render mtime checks outside dev
+    cache_size=-1, # Never evict compiled templates
+    bytecode_cache=FileSystemBytecodeCache(os.fspath(BYTECODE_CACHE_DIR)),
+)
+templates = Jinja2Templates(env=env)
+
+# --- Pre-compile templates so renders are a pure cache lookup ---
+for template_path in TEMPLATES_DIR.glob("*.html"):
+    env.get_template(template_path.name)
+# ----------------------------------------------------------------
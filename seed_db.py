@@ -1,5 +1,6 @@
 import os
 import random
+import uuid
 from datetime import datetime, timedelta, timezone
 from zoneinfo import ZoneInfo
 from sqlalchemy import create_engine
@@ -7,7 +8,7 @@ from sqlalchemy.orm import sessionmaker
 from faker import Faker 
 
 from app.database import Base, engine 
-from app.models import Attendance, Employee 
+from app.models import Employee, bulk_insert_attendance 
 
 # --- Configuration ---
 NUM_EMPLOYEES = 10       # 25 unique people
@@ -34,17 +35,19 @@ print(f"Generating data for {NUM_EMPLOYEES} employees over {NUM_DAYS} days...")
 
 try:
     # 1. Generate Employees
-    employees_to_create = []
-    employee_emails = set()
-    
     # Fetch existing emails to avoid duplicates
     existing_emails = {emp.email for emp in db.query(Employee.email).all()}
     
-    while len(employees_to_create) + len(existing_emails) < NUM_EMPLOYEES:
+    # fake.unique never repeats itself, so only rows already in the DB need filtering
+    new_emails = []
+    while len(new_emails) + len(existing_emails) < NUM_EMPLOYEES:
          email = fake.unique.email()
-         if email not in existing_emails and email not in employee_emails:
-              employees_to_create.append(Employee(email=email, display_name=fake.name()))
-              employee_emails.add(email)
+         if email not in existing_emails:
+              new_emails.append(email)
+    names = [fake.name() for _ in new_emails]
+    employees_to_create = [
+         Employee(email=email, display_name=name) for email, name in zip(new_emails, names)
+    ]
     
     if employees_to_create:
          print(f"Adding {len(employees_to_create)} new employees...")
@@ -56,6 +59,8 @@ try:
     # 2. Generate Attendance
     attendance_records = []
     today = datetime.now(est_zone).date()
+    utc = timezone.utc
+    checkin_minutes = range(7 * 60, 11 * 60) # Minute of day, 7:00 AM to 10:59 AM
     
     print("Generating attendance records...")
     for i in range(NUM_DAYS):
@@ -65,43 +70,41 @@ try:
         if current_date.weekday() >= 5: 
             continue 
 
-        current_date_str = current_date.strftime("%Y-%m-%d")
+        current_date_str = current_date.isoformat()
+        day_start_est = datetime(current_date.year, current_date.month, current_date.day, tzinfo=est_zone)
+
+        # Draw the whole day's randomness in batches instead of per employee
+        present = [emp for emp in all_employees if random.random() < CHECK_IN_RATE]
+        count = len(present)
+        minutes = random.choices(checkin_minutes, k=count)
+        reasons = random.choices(VISIT_REASONS, k=count)          # Random Reason
+        business_lines = random.choices(BUSINESS_LINES, k=count)  # Random Business Line
 
-        for employee in all_employees:
-            # Random chance to check in
-            if random.random() < CHECK_IN_RATE:
-                # Random time between 7:30 AM and 10:30 AM
-                checkin_hour = random.randint(7, 10)
-                checkin_minute = random.randint(0, 59)
-                
-                timestamp_est = datetime(
-                    current_date.year, current_date.month, current_date.day,
-                    checkin_hour, checkin_minute, 0,
-                    tzinfo=est_zone
-                )
-                timestamp_utc = timestamp_est.astimezone(timezone.utc)
+        for employee, minute, reason, business_line in zip(present, minutes, reasons, business_lines):
+            # Wall-clock arithmetic on the aware datetime keeps DST handling intact
+            timestamp_utc = (day_start_est + timedelta(minutes=minute)).astimezone(utc)
 
-                attendance_records.append(Attendance(
-                    timestamp_utc=timestamp_utc,
-                    local_date=current_date_str,
-                    site=SITE_CODE,
-                    event_type="check_in",
-                    user_name=employee.display_name,
-                    user_email=employee.email,
-                    visit_reason=random.choice(VISIT_REASONS),     # Random Reason
-                    business_line=random.choice(BUSINESS_LINES),   # Random Business Line
-                    device_local_id=fake.uuid4(),                  # Fake Device ID
-                    source="dummy_data",
-                    is_valid=True
-                ))
+            # Plain column dicts: inserted through Core, no ORM objects per row
+            attendance_records.append(dict(
+                timestamp_utc=timestamp_utc,
+                local_date=current_date_str,
+                site=SITE_CODE,
+                event_type="check_in",
+                user_name=employee.display_name,
+                user_email=employee.email,
+                visit_reason=reason,
+                business_line=business_line,
+                device_local_id=str(uuid.uuid4()),             # Fake Device ID
+                source="dummy_data",
+                is_valid=True
+            ))
 
     print(f"Adding {len(attendance_records)} attendance records...")
     
-    # Add in chunks to avoid massive transactions
+    # Add in chunks to avoid massive transactions; each chunk is one executemany
     chunk_size = 500
     for i in range(0, len(attendance_records), chunk_size):
-        db.add_all(attendance_records[i:i + chunk_size])
-        db.commit()
+        bulk_insert_attendance(db, attendance_records[i:i + chunk_size])
         print(f"Committed chunk {i//chunk_size + 1}...")
 
     print("Dummy data generation complete!")